@@ -0,0 +1,128 @@
+"""Module approximator for int8 quantized attention query key product."""
+
+from typing import Any, Dict, List
+
+import torch
+from torch import Tensor, nn
+
+from ...core import ModuleApproximator
+from ...multihead.customizable_multihead import _scaled_dot_product
+
+# maximum magnitude representable by a symmetric int8 quantization
+INT8_MAX = 127.0
+
+
+class Int8QueryKeyDotProductApproximator(ModuleApproximator):
+    """Handles the approximation of the query-key product in a multihead attention module.
+
+    Attributes:
+        supported_layer_types: contains the classes of the modules or functions that the approximator can approximate.
+        approximation_type: name to identify the approximator referring to the type of approximation module.
+        is_approximation_trainable: establishes if the approximation contain some trainable parameters.
+    """
+
+    supported_layer_types = {_scaled_dot_product}
+    approximation_type = "int8_query_key_product"
+    is_approximation_trainable = False
+
+    def __init__(
+        self, parameters: Dict[str, Any] = {}, **kwargs: Dict[str, Any]
+    ) -> None:
+        """Initializes the Int8QueryKeyDotProductApproximator.
+
+        Args:
+            parameters: parameters of the Int8QueryKeyDotProduct modules. Defaults to {}.
+        """
+        super().__init__(parameters, **kwargs)
+        self.approximations: List[Int8QueryKeyDotProduct] = []
+
+    def get_trainable_approximation(self, **kwargs: Any) -> nn.Module:
+        """Approximates the module for the training phase.
+
+        Returns:
+            approximated module ready for the training phase.
+        """
+        new_approximation = Int8QueryKeyDotProduct()
+        # adding the module to the approximation list
+        self.approximations.append(new_approximation)
+        return new_approximation
+
+    def get_pretrained_approximation(
+        self, module: nn.Module, **kwargs: Any
+    ) -> nn.Module:
+        """Converts the trainable approximation of the module into its pretrained form.
+
+        Args:
+            module: module approximation to be converted.
+
+        Raises:
+            ValueError: this method must be called for Int8QueryKeyDotProduct modules.
+
+        Returns:
+            approximated module in its pretrained form.
+        """
+        if not isinstance(module, Int8QueryKeyDotProduct):
+            raise ValueError(f"{module.__class__} is not a {Int8QueryKeyDotProduct}")
+        return module
+
+
+class Int8QueryKeyDotProduct(nn.Module):
+    """Int8 quantized scaled query-key dot product for attention.
+
+    The query and key rows are quantized symmetrically to the int8 range with
+    dynamic per-row scales, the dot product runs over the quantized values and
+    the per-row scales (together with the 1/sqrt(E) attention scaling) are
+    applied in a single dequantization multiply on the scores. The quantized
+    operands hold integer values, so the product is exact with respect to a
+    dedicated int8 GEMM; torch._int_mm only accepts 2-D CUDA operands, hence
+    the batched product is computed with the regular bmm.
+
+    Attributes:
+        is_approximation_of: class of the approximated module/function.
+    """
+
+    is_approximation_of = _scaled_dot_product
+
+    def __init__(self, eps: float = 1e-8) -> None:
+        """Initializes the Int8QueryKeyDotProduct.
+
+        Args:
+            eps: lower bound of the quantization scales, guarding all-zero rows. Defaults to 1e-8.
+        """
+        super().__init__()
+        self.eps = eps
+
+    def forward(self, query: Tensor, key: Tensor) -> Tensor:
+        """Int8 quantized scaled query-key dot product.
+
+        Args:
+            query: attention query values.
+            key: attention key values.
+
+        Returns:
+            scaled dot product between the quantized query and key matrices.
+        """
+        _, _, E = query.shape
+        # symmetric per-row absmax quantization scales
+        query_scale = (
+            query.abs().amax(dim=-1, keepdim=True).clamp_min(self.eps) / INT8_MAX
+        )
+        key_scale = key.abs().amax(dim=-1, keepdim=True).clamp_min(self.eps) / INT8_MAX
+        query_int = query / query_scale
+        key_int = key / key_scale
+        rounded_query = query_int.round().clamp_(-INT8_MAX, INT8_MAX)
+        rounded_key = key_int.round().clamp_(-INT8_MAX, INT8_MAX)
+        if torch.is_grad_enabled() and (query.requires_grad or key.requires_grad):
+            # straight-through estimator: rounding behaves as the identity in the
+            # backward pass, keeping the product usable during training
+            query_int = query_int + (rounded_query - query_int).detach()
+            key_int = key_int + (rounded_key - key_int).detach()
+        else:
+            query_int = rounded_query
+            key_int = rounded_key
+        # (B, Nt, E) x (B, E, Ns) -> (B, Nt, Ns)
+        scores = torch.bmm(query_int, key_int.transpose(-2, -1))
+        # dequantization and attention scaling fused in a single multiply
+        return scores * (
+            query_scale * key_scale.transpose(-2, -1) * (float(E) ** -0.5)
+        )
@@ -1,7 +1,8 @@
 """Module approximator for Multihead layers."""
 
-import math
 import warnings
+import weakref
+from contextlib import nullcontext
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import torch
@@ -13,6 +14,24 @@ from torch.nn.functional import dropout, linear
 from torch.overrides import handle_torch_function, has_torch_function
 
 from ..core import ModuleApproximator
+from .flash_custom_kernel import (
+    is_pointwise_kernel_function,
+    tiled_scaled_dot_product_attention,
+)
+
+# checking the availability of the fused scaled dot product attention (torch>=2.0)
+HAS_FUSED_ATTENTION = hasattr(torch.nn.functional, "scaled_dot_product_attention")
+
+# number of converted attention masks kept per module before the cache is reset
+MASK_CACHE_MAX_SIZE = 8
+
+# default kernel function, shared across the signatures below instead of being
+# rebuilt in every default argument
+_DEFAULT_SOFTMAX = nn.Softmax(dim=-1)
+
+# tensor types that can never trigger the torch.overrides dispatch: the weights
+# and biases are nn.Parameter, which disables __torch_function__
+_PLAIN_TENSOR_TYPES = (Tensor, nn.Parameter)
 
 
 class CustomizableMultiHeadApproximator(ModuleApproximator):
@@ -94,7 +113,15 @@ class CustomizableMultiHeadApproximator(ModuleApproximator):
         self.parameters["kdim"] = self.parameters.get("kdim", original_multihead.kdim)
         self.parameters["vdim"] = self.parameters.get("vdim", original_multihead.vdim)
 
-        new_approximation = CustomizableMultiHead(**self.parameters)
+        # the quantize parameter only drives the pretrained conversion and is not
+        # a CustomizableMultiHead argument
+        new_approximation = CustomizableMultiHead(
+            **{
+                name: value
+                for name, value in self.parameters.items()
+                if name != "quantize"
+            }
+        )
 
         # loading the weights (parameters) of the multihead module that is going to be approximated
         for name, params in original_multihead.named_parameters():
@@ -124,24 +151,52 @@ class CustomizableMultiHeadApproximator(ModuleApproximator):
         """
         if not isinstance(module, CustomizableMultiHead):
             raise ValueError(f"{module.__class__} is not a {CustomizableMultiHead}")
+        # optionally replacing the exact query-key product with its int8
+        # quantized form for inference deployment
+        if self.parameters.get("quantize") == "int8":
+            # imported locally to avoid a circular import with the approximator
+            from ..attention.query_key_product.quantized import Int8QueryKeyDotProduct
+
+            module.query_key_product = Int8QueryKeyDotProduct()
         return module
 
 
-def _scaled_dot_product(query: Tensor, key: Tensor) -> Tensor:
+def _scaled_dot_product(
+    query: Tensor,
+    key: Tensor,
+    scale: Optional[float] = None,
+    out: Optional[Tensor] = None,
+) -> Tensor:
     """Scaled attention query-key dot product.
     Part of `torch.nn.functional._scaled_dot_product_attention`.
 
     Args:
         query: attention query values.
         key: attention key values.
+        scale: precomputed scaling factor; computed from the head dimension when None. Defaults to None.
+        out: preallocated tensor receiving the result. Defaults to None.
 
     Returns:
         dot product between query and key matrices
     """
-    B, Nt, E = query.shape
-    query = query / math.sqrt(E)
+    _, _, E = query.shape
+    if scale is None:
+        scale = float(E) ** -0.5
+    # fusing the scaling into the matmul epilogue (beta=0 ignores the input, which
+    # can therefore be empty/uninitialized) avoids a full elementwise pass over
+    # the query tensor
     # (B, Nt, E) x (B, E, Ns) -> (B, Nt, Ns)
-    return torch.bmm(query, key.transpose(-2, -1))
+    if out is None:
+        # out= variants do not support autograd, so without a scratch buffer the
+        # product goes through the differentiable allocation-free form
+        return torch.baddbmm(
+            torch.empty((1, 1, 1), dtype=query.dtype, device=query.device),
+            query,
+            key.transpose(-2, -1),
+            beta=0,
+            alpha=scale,
+        )
+    return torch.baddbmm(out, query, key.transpose(-2, -1), beta=0, alpha=scale, out=out)
 
 
 def _attn_masking(attn: Tensor, attn_mask: Tensor, attn_mask_value: float) -> Tensor:
@@ -161,28 +216,269 @@ def _attn_masking(attn: Tensor, attn_mask: Tensor, attn_mask_value: float) -> Te
     return attn
 
 
+def _scratch_buffer(
+    scratch: Dict[str, Tensor],
+    name: str,
+    shape: Tuple[int, int, int],
+    dtype: torch.dtype,
+    device: torch.device,
+) -> Tensor:
+    """Returns a persistent scratch tensor of the requested shape.
+
+    The underlying flat buffer is kept in the scratch dictionary and only
+    reallocated when it is too small (or the dtype/device changed), so under
+    fixed-shape inference the buffer is allocated once and reused.
+
+    Args:
+        scratch: per-module dictionary holding the flat buffers.
+        name: key of the buffer in the scratch dictionary.
+        shape: shape of the requested tensor.
+        dtype: dtype of the requested tensor.
+        device: device of the requested tensor.
+
+    Returns:
+        uninitialized tensor view of the requested shape.
+    """
+    numel = shape[0] * shape[1] * shape[2]
+    buffer = scratch.get(name)
+    if (
+        buffer is None
+        or buffer.numel() < numel
+        or buffer.dtype != dtype
+        or buffer.device != device
+    ):
+        buffer = torch.empty(numel, dtype=dtype, device=device)
+        scratch[name] = buffer
+    return buffer[:numel].view(shape)
+
+
+def _append_bias_row(tensor: Tensor, bias: Tensor, batch_first: bool) -> Tensor:
+    """Appends a bias row along the sequence dimension of a key/value tensor.
+
+    Equivalent to concatenating the bias repeated over the batch dimension, but
+    the result is written directly into a single preallocated tensor: the key
+    rows are copied once and the bias row is broadcast into the last position,
+    without materializing the repeated bias.
+
+    Args:
+        tensor: key or value tensor of shape (bsz, seq_len, E) or (seq_len, bsz, E).
+        bias: bias row of shape (1, 1, E).
+        batch_first: whether the batch dimension of the tensor comes first.
+
+    Returns:
+        tensor of sequence length seq_len + 1 with the bias row appended.
+    """
+    if batch_first:
+        bsz, seq_len, embed_dim = tensor.shape
+        padded = torch.empty(
+            (bsz, seq_len + 1, embed_dim), dtype=tensor.dtype, device=tensor.device
+        )
+        padded[:, :seq_len].copy_(tensor)
+        # broadcasting the (1, E) bias row over the batch dimension
+        padded[:, seq_len] = bias.squeeze(0)
+    else:
+        seq_len, bsz, embed_dim = tensor.shape
+        padded = torch.empty(
+            (seq_len + 1, bsz, embed_dim), dtype=tensor.dtype, device=tensor.device
+        )
+        padded[:seq_len].copy_(tensor)
+        padded[seq_len] = bias.squeeze(0)
+    return padded
+
+
+def _single_chunk_attention(
+    q: Tensor,
+    k: Tensor,
+    v: Tensor,
+    attn_mask: Optional[Tensor],
+    dropout_p: float,
+    kernel_function: Union[nn.Module, Callable],
+    attn_mask_value: float,
+    attn_masking_function: Union[nn.Module, Callable],
+    query_key_product: Union[nn.Module, Callable],
+    q_scale: Optional[float] = None,
+    scratch: Optional[Dict[str, Tensor]] = None,
+    reuse_attn: bool = True,
+) -> Tuple[Tensor, Tensor]:
+    """Attention computation for a (chunk of) query rows.
+
+    Args:
+        q: attention query values, possibly a chunk of the query rows.
+        k: attention key values.
+        v: attention value values.
+        attn_mask: attention mask for the given query rows.
+        dropout_p: dropout probability.
+        kernel_function: function applied to the masked attention.
+        attn_mask_value: masking value (i.e. what normally is -inf).
+        attn_masking_function: function that implements the attention masking mechanism.
+        query_key_product: function that implements the attention query-key product mechanism.
+        q_scale: precomputed query scaling factor, consumed by the default query-key product. Defaults to None.
+        scratch: persistent buffers for the score and output tensors, used only outside autograd. Defaults to None.
+        reuse_attn: whether the score tensor may live in a scratch buffer; must be False when the weights escape to the caller. Defaults to True.
+
+    Returns:
+        tuple containing the attention output and the attention weights for the given query rows.
+    """
+    # the out= variants cannot participate in autograd, so the scratch buffers
+    # are only used when gradients are not being tracked
+    use_scratch = scratch is not None and not torch.is_grad_enabled()
+    if (
+        query_key_product is _scaled_dot_product
+        and attn_masking_function is _attn_masking
+        and attn_mask is not None
+        and attn_mask.dtype == q.dtype
+    ):
+        # fusing the additive mask into the matmul epilogue (beta=1) halves the
+        # passes over the score tensor compared to a matmul followed by an add
+        B, Nt, E = q.shape
+        if q_scale is None:
+            q_scale = float(E) ** -0.5
+        if use_scratch and reuse_attn:
+            attn = torch.baddbmm(
+                attn_mask.expand(B, Nt, k.shape[1]),
+                q,
+                k.transpose(-2, -1),
+                beta=1.0,
+                alpha=q_scale,
+                out=_scratch_buffer(
+                    scratch, "attn", (B, Nt, k.shape[1]), q.dtype, q.device
+                ),
+            )
+        else:
+            attn = torch.baddbmm(
+                attn_mask.expand(B, Nt, k.shape[1]),
+                q,
+                k.transpose(-2, -1),
+                beta=1.0,
+                alpha=q_scale,
+            )
+    else:
+        if query_key_product is _scaled_dot_product:
+            attn_out = None
+            if use_scratch and reuse_attn:
+                B, Nt, _ = q.shape
+                attn_out = _scratch_buffer(
+                    scratch, "attn", (B, Nt, k.shape[1]), q.dtype, q.device
+                )
+            attn = query_key_product(q, k, q_scale, out=attn_out)
+        else:
+            attn = query_key_product(q, k)
+
+        attn = attn_masking_function(attn, attn_mask, attn_mask_value)
+
+    if type(kernel_function) is nn.Softmax:
+        # calling the softmax directly skips the nn.Module hook dispatch; when
+        # autograd does not track the scores the normalization runs fully in
+        # place, so no second score-sized tensor is allocated
+        if attn.requires_grad:
+            attn = torch.softmax(attn, dim=kernel_function.dim)
+        else:
+            attn = attn.sub_(attn.amax(dim=kernel_function.dim, keepdim=True)).exp_()
+            attn.div_(attn.sum(dim=kernel_function.dim, keepdim=True))
+    else:
+        attn = kernel_function(attn)  # (B, Nt, Ns)
+
+    if dropout_p > 0.0:
+        attn = dropout(attn, p=dropout_p)
+    # (B, Nt, Ns) x (B, Ns, E) -> (B, Nt, E)
+    if use_scratch:
+        output = torch.bmm(
+            attn,
+            v,
+            out=_scratch_buffer(
+                scratch,
+                "output",
+                (attn.shape[0], attn.shape[1], v.shape[2]),
+                attn.dtype,
+                attn.device,
+            ),
+        )
+    else:
+        output = torch.bmm(attn, v)
+    return output, attn
+
+
 def _scaled_dot_product_attention(
     q: Tensor,
     k: Tensor,
     v: Tensor,
     attn_mask: Optional[Tensor] = None,
     dropout_p: float = 0.0,
-    kernel_function: Union[nn.Module, Callable] = nn.Softmax(dim=-1),
+    kernel_function: Union[nn.Module, Callable] = _DEFAULT_SOFTMAX,
     attn_mask_value: float = float("-inf"),
     attn_masking_function: Union[nn.Module, Callable] = _attn_masking,
     query_key_product: Union[nn.Module, Callable] = _scaled_dot_product,
-) -> Tuple[Tensor, Tensor]:
-    """Reworked method from `torch.nn.functional._scaled_dot_product_attention`."""
-    attn = query_key_product(q, k)
+    max_chunk_size_mb: Optional[int] = None,
+    q_scale: Optional[float] = None,
+    need_weights: bool = True,
+    scratch: Optional[Dict[str, Tensor]] = None,
+) -> Tuple[Tensor, Optional[Tensor]]:
+    """Reworked method from `torch.nn.functional._scaled_dot_product_attention`.
 
-    attn = attn_masking_function(attn, attn_mask, attn_mask_value)
+    When max_chunk_size_mb is given, the query rows are processed in chunks
+    sized so that each intermediate score chunk stays within the requested
+    memory budget, lowering the peak memory of the attention computation.
 
-    attn = kernel_function(attn)  # (B, Nt, Ns)
+    When need_weights is False the attention weights are not returned (and, in
+    the chunked computation, never assembled), so they do not have to be kept
+    alive for the caller or for autograd.
+    """
+    B, Nt, _ = q.shape
+    src_len = k.shape[1]
 
-    if dropout_p > 0.0:
-        attn = dropout(attn, p=dropout_p)
-    # (B, Nt, Ns) x (B, Ns, E) -> (B, Nt, E)
-    output = torch.bmm(attn, v)
+    if max_chunk_size_mb is not None:
+        chunk = max(1, (max_chunk_size_mb << 20) // (B * src_len * q.element_size()))
+    else:
+        chunk = Nt
+
+    # the chunked computation slices the mask per chunk, which is only safe with the
+    # default additive masking (custom masking modules may transform the mask in place)
+    if chunk >= Nt or attn_masking_function is not _attn_masking:
+        output, attn = _single_chunk_attention(
+            q,
+            k,
+            v,
+            attn_mask,
+            dropout_p,
+            kernel_function,
+            attn_mask_value,
+            attn_masking_function,
+            query_key_product,
+            q_scale,
+            scratch=scratch,
+            # the weights escape to the caller, so they must not live in a
+            # reused scratch buffer
+            reuse_attn=not need_weights,
+        )
+        return output, attn if need_weights else None
+
+    if attn_mask is not None:
+        # broadcasting the mask to the score matrix sizes (views, no allocation)
+        # so that it can be sliced consistently with the query chunks
+        attn_mask = attn_mask.expand(attn_mask.shape[0], Nt, src_len)
+
+    # preallocating the outputs to avoid concatenating the per-chunk results
+    output = torch.empty((B, Nt, v.shape[2]), dtype=q.dtype, device=q.device)
+    attn: Optional[Tensor] = None
+    if need_weights:
+        attn = torch.empty((B, Nt, src_len), dtype=q.dtype, device=q.device)
+    for i in range(0, Nt, chunk):
+        chunk_output, chunk_attn = _single_chunk_attention(
+            q[:, i : i + chunk],
+            k,
+            v,
+            attn_mask[..., i : i + chunk, :] if attn_mask is not None else None,
+            dropout_p,
+            kernel_function,
+            attn_mask_value,
+            attn_masking_function,
+            query_key_product,
+            q_scale,
+            scratch=scratch,
+        )
+        output[:, i : i + chunk] = chunk_output
+        if attn is not None:
+            attn[:, i : i + chunk] = chunk_attn
     return output, attn
 
 
@@ -208,11 +504,14 @@ class CustomizableMultiHead(nn.MultiheadAttention):
         batch_first=False,
         device=None,
         dtype=None,
-        kernel_function: Union[nn.Module, Callable] = nn.Softmax(dim=-1),
+        kernel_function: Union[nn.Module, Callable] = _DEFAULT_SOFTMAX,
         attn_mask_value: float = float("-inf"),
         attention_function: Union[nn.Module, Callable] = _scaled_dot_product_attention,
         attn_masking_function: Union[nn.Module, Callable] = _attn_masking,
         query_key_product: Union[nn.Module, Callable] = _scaled_dot_product,
+        max_chunk_size_mb: Optional[int] = None,
+        autocast_dtype: Optional[torch.dtype] = None,
+        validate_inputs: bool = True,
     ) -> None:
         """Reworked method from `torch.nn.MultiheadAttention`.
 
@@ -222,6 +521,9 @@ class CustomizableMultiHead(nn.MultiheadAttention):
             attention_function: function that implements the attention mechanism. Defaults to _scaled_dot_product_attention.
             attn_masking_function: function that implements the attention masking mechanism. Defaults to _attn_masking.
             query_key_product: function that implements the attention query-key product mechanism. Defaults to _scaled_dot_product.
+            max_chunk_size_mb: memory budget (in MB) for the intermediate attention scores; when given, the query rows are processed in chunks that fit the budget. Defaults to None.
+            autocast_dtype: reduced precision dtype (e.g. torch.bfloat16) under which the attention body is run on CUDA float32 inputs; halves the memory traffic of the score tensors. Defaults to None.
+            validate_inputs: whether the per-forward shape checks are run; disabling them removes pure Python overhead once the input shapes are known to be correct. Defaults to True.
 
         """
         super().__init__(
@@ -243,6 +545,20 @@ class CustomizableMultiHead(nn.MultiheadAttention):
         self.attention_function = attention_function
         self.attn_masking_function = attn_masking_function
         self.query_key_product = query_key_product
+        self.max_chunk_size_mb = max_chunk_size_mb
+        self.autocast_dtype = autocast_dtype
+        self.validate_inputs = validate_inputs
+        # precomputing the query scaling factor once instead of deriving it per call
+        self.q_scale = float(self.head_dim) ** -0.5
+        # cache for the bool -> float converted attention masks
+        self._mask_cache: Dict[Tuple, Tensor] = {}
+        # persistent scratch buffers for the attention score and output tensors,
+        # used by the attention computation outside autograd
+        self._scratch: Dict[str, Tensor] = {}
+        # cached (b_q, b_k, b_v) views of in_proj_bias for the separate projection
+        # weight branch, together with the parameter and storage they were taken
+        # from so they can be recomputed if either is replaced
+        self._in_proj_bias_views: Optional[Tuple[Tensor, int, Tuple]] = None
 
     def forward(
         self,
@@ -250,76 +566,126 @@ class CustomizableMultiHead(nn.MultiheadAttention):
         key: Tensor,
         value: Tensor,
         key_padding_mask: Optional[Tensor] = None,
-        need_weights: bool = True,
+        need_weights: bool = False,
         attn_mask: Optional[Tensor] = None,
         average_attn_weights: bool = True,
     ) -> Tuple[Tensor, Optional[Tensor]]:
-        """Reworked method from `torch.nn.MultiheadAttention`."""
+        """Reworked method from `torch.nn.MultiheadAttention`.
 
-        is_batched = query.dim() == 3
-        if self.batch_first and is_batched:
-            query, key, value = [x.transpose(1, 0) for x in (query, key, value)]
+        Differently from `torch.nn.MultiheadAttention`, need_weights defaults to
+        False: the (bsz, num_heads, tgt_len, src_len) attention weights are the
+        largest activation of the layer, and skipping them also enables the
+        fused and tiled attention paths.
 
-        if not self._qkv_same_embed_dim:
-            attn_output, attn_output_weights = _multi_head_attention_forward(
-                query,
-                key,
-                value,
-                self.embed_dim,
-                self.num_heads,
-                self.in_proj_weight,
-                self.in_proj_bias,
-                self.bias_k,
-                self.bias_v,
-                self.add_zero_attn,
-                self.dropout,
-                self.out_proj.weight,
-                self.out_proj.bias,
-                training=self.training,
-                key_padding_mask=key_padding_mask,
-                need_weights=need_weights,
-                attn_mask=attn_mask,
-                use_separate_proj_weight=True,
-                q_proj_weight=self.q_proj_weight,
-                k_proj_weight=self.k_proj_weight,
-                v_proj_weight=self.v_proj_weight,
-                average_attn_weights=average_attn_weights,
-                kernel_function=self.kernel_function,
-                attn_mask_value=self.attn_mask_value,
-                attention_function=self.attention_function,
-                attn_masking_function=self.attn_masking_function,
-                query_key_product=self.query_key_product,
-            )
-        else:
-            attn_output, attn_output_weights = _multi_head_attention_forward(
-                query,
-                key,
-                value,
-                self.embed_dim,
-                self.num_heads,
-                self.in_proj_weight,
-                self.in_proj_bias,
-                self.bias_k,
-                self.bias_v,
-                self.add_zero_attn,
-                self.dropout,
-                self.out_proj.weight,
-                self.out_proj.bias,
-                training=self.training,
-                key_padding_mask=key_padding_mask,
-                need_weights=need_weights,
-                attn_mask=attn_mask,
-                average_attn_weights=average_attn_weights,
-                kernel_function=self.kernel_function,
-                attn_mask_value=self.attn_mask_value,
-                attention_function=self.attention_function,
-                attn_masking_function=self.attn_masking_function,
-                query_key_product=self.query_key_product,
+        Batch-first inputs are consumed natively by the attention forward
+        instead of being transposed on entry and exit, which avoids the
+        contiguous copies those transposed views forced downstream.
+        """
+
+        # optionally running the attention body in reduced precision: matmuls hit the
+        # tensor cores and the score tensors move half the bytes through memory
+        if (
+            self.autocast_dtype is not None
+            and query.is_cuda
+            and query.dtype == torch.float32
+        ):
+            autocast_context = torch.autocast(
+                device_type=query.device.type, dtype=self.autocast_dtype
             )
-        if self.batch_first and is_batched:
-            return attn_output.transpose(1, 0), attn_output_weights
         else:
-            return attn_output, attn_output_weights
+            autocast_context = nullcontext()
+
+        with autocast_context:
+            if not self._qkv_same_embed_dim:
+                # chunking in_proj_bias yields three views that only depend on the
+                # parameter, so they are computed once and reused until the
+                # parameter object or its storage changes
+                in_proj_bias_chunks = None
+                if self.in_proj_bias is not None:
+                    cached = self._in_proj_bias_views
+                    if (
+                        cached is None
+                        or cached[0] is not self.in_proj_bias
+                        or cached[1] != self.in_proj_bias.data_ptr()
+                    ):
+                        cached = (
+                            self.in_proj_bias,
+                            self.in_proj_bias.data_ptr(),
+                            self.in_proj_bias.chunk(3),
+                        )
+                        self._in_proj_bias_views = cached
+                    in_proj_bias_chunks = cached[2]
+                attn_output, attn_output_weights = _multi_head_attention_forward(
+                    query,
+                    key,
+                    value,
+                    self.embed_dim,
+                    self.num_heads,
+                    self.in_proj_weight,
+                    self.in_proj_bias,
+                    self.bias_k,
+                    self.bias_v,
+                    self.add_zero_attn,
+                    self.dropout,
+                    self.out_proj.weight,
+                    self.out_proj.bias,
+                    training=self.training,
+                    key_padding_mask=key_padding_mask,
+                    need_weights=need_weights,
+                    attn_mask=attn_mask,
+                    use_separate_proj_weight=True,
+                    q_proj_weight=self.q_proj_weight,
+                    k_proj_weight=self.k_proj_weight,
+                    v_proj_weight=self.v_proj_weight,
+                    average_attn_weights=average_attn_weights,
+                    kernel_function=self.kernel_function,
+                    attn_mask_value=self.attn_mask_value,
+                    attention_function=self.attention_function,
+                    attn_masking_function=self.attn_masking_function,
+                    query_key_product=self.query_key_product,
+                    max_chunk_size_mb=self.max_chunk_size_mb,
+                    q_scale=self.q_scale,
+                    mask_cache=self._mask_cache,
+                    head_dim=self.head_dim,
+                    validate_inputs=self.validate_inputs,
+                    in_proj_bias_chunks=in_proj_bias_chunks,
+                    batch_first=self.batch_first,
+                    scratch=self._scratch,
+                )
+            else:
+                attn_output, attn_output_weights = _multi_head_attention_forward(
+                    query,
+                    key,
+                    value,
+                    self.embed_dim,
+                    self.num_heads,
+                    self.in_proj_weight,
+                    self.in_proj_bias,
+                    self.bias_k,
+                    self.bias_v,
+                    self.add_zero_attn,
+                    self.dropout,
+                    self.out_proj.weight,
+                    self.out_proj.bias,
+                    training=self.training,
+                    key_padding_mask=key_padding_mask,
+                    need_weights=need_weights,
+                    attn_mask=attn_mask,
+                    average_attn_weights=average_attn_weights,
+                    kernel_function=self.kernel_function,
+                    attn_mask_value=self.attn_mask_value,
+                    attention_function=self.attention_function,
+                    attn_masking_function=self.attn_masking_function,
+                    query_key_product=self.query_key_product,
+                    max_chunk_size_mb=self.max_chunk_size_mb,
+                    q_scale=self.q_scale,
+                    mask_cache=self._mask_cache,
+                    head_dim=self.head_dim,
+                    validate_inputs=self.validate_inputs,
+                    batch_first=self.batch_first,
+                    scratch=self._scratch,
+                )
+        return attn_output, attn_output_weights
 
 
 def _multi_head_attention_forward(
@@ -347,12 +713,21 @@ def _multi_head_attention_forward(
     static_k: Optional[Tensor] = None,
     static_v: Optional[Tensor] = None,
     average_attn_weights: bool = True,
-    kernel_function: Union[nn.Module, Callable] = nn.Softmax(dim=-1),
+    kernel_function: Union[nn.Module, Callable] = _DEFAULT_SOFTMAX,
     attn_mask_value: float = float("-inf"),
     attention_function: Union[nn.Module, Callable] = _scaled_dot_product_attention,
     attn_masking_function: Union[nn.Module, Callable] = _attn_masking,
     query_key_product: Union[nn.Module, Callable] = _scaled_dot_product,
+    max_chunk_size_mb: Optional[int] = None,
+    q_scale: Optional[float] = None,
+    mask_cache: Optional[Dict[Tuple, Tensor]] = None,
+    head_dim: Optional[int] = None,
+    validate_inputs: bool = True,
+    in_proj_bias_chunks: Optional[Tuple[Tensor, Tensor, Tensor]] = None,
+    batch_first: bool = False,
+    scratch: Optional[Dict[str, Tensor]] = None,
 ) -> Tuple[Tensor, Optional[Tensor]]:
+    """Reworked method from `torch.nn.MultiheadAttention`."""
     tens_ops = (
         query,
         key,
@@ -364,50 +739,66 @@ def _multi_head_attention_forward(
         out_proj_weight,
         out_proj_bias,
     )
-    """Reworked method from `torch.nn.MultiheadAttention`."""
-    if has_torch_function(tens_ops):
-        return handle_torch_function(
-            _multi_head_attention_forward,
-            tens_ops,
-            query,
-            key,
-            value,
-            embed_dim_to_check,
-            num_heads,
-            in_proj_weight,
-            in_proj_bias,
-            bias_k,
-            bias_v,
-            add_zero_attn,
-            dropout_p,
-            out_proj_weight,
-            out_proj_bias,
-            training=training,
-            key_padding_mask=key_padding_mask,
-            need_weights=need_weights,
-            attn_mask=attn_mask,
-            use_separate_proj_weight=use_separate_proj_weight,
-            q_proj_weight=q_proj_weight,
-            k_proj_weight=k_proj_weight,
-            v_proj_weight=v_proj_weight,
-            static_k=static_k,
-            static_v=static_v,
-            kernel_function=kernel_function,
-            attn_mask_value=attn_mask_value,
-            attention_function=attention_function,
-            attn_masking_function=attn_masking_function,
-            query_key_product=query_key_product,
-        )
+    # the torch.overrides dispatch can only trigger when a tensor subclass with
+    # a live __torch_function__ is involved: plain tensors and parameters (which
+    # disable it) keep the dispatcher machinery off the hot path
+    if any(type(t) not in _PLAIN_TENSOR_TYPES for t in tens_ops if t is not None):
+        if has_torch_function(tens_ops):
+            return handle_torch_function(
+                _multi_head_attention_forward,
+                tens_ops,
+                query,
+                key,
+                value,
+                embed_dim_to_check,
+                num_heads,
+                in_proj_weight,
+                in_proj_bias,
+                bias_k,
+                bias_v,
+                add_zero_attn,
+                dropout_p,
+                out_proj_weight,
+                out_proj_bias,
+                training=training,
+                key_padding_mask=key_padding_mask,
+                need_weights=need_weights,
+                attn_mask=attn_mask,
+                use_separate_proj_weight=use_separate_proj_weight,
+                q_proj_weight=q_proj_weight,
+                k_proj_weight=k_proj_weight,
+                v_proj_weight=v_proj_weight,
+                static_k=static_k,
+                static_v=static_v,
+                kernel_function=kernel_function,
+                attn_mask_value=attn_mask_value,
+                attention_function=attention_function,
+                attn_masking_function=attn_masking_function,
+                query_key_product=query_key_product,
+                max_chunk_size_mb=max_chunk_size_mb,
+                q_scale=q_scale,
+                mask_cache=mask_cache,
+                head_dim=head_dim,
+                validate_inputs=validate_inputs,
+                in_proj_bias_chunks=in_proj_bias_chunks,
+                batch_first=batch_first,
+                scratch=scratch,
+            )
 
-    is_batched = _mha_shape_check(
-        query, key, value, key_padding_mask, attn_mask, num_heads
-    )
+    if validate_inputs:
+        is_batched = _mha_shape_check(
+            query, key, value, key_padding_mask, attn_mask, num_heads
+        )
+    else:
+        is_batched = query.dim() == 3
 
     # For unbatched input, we unsqueeze at the expected batch-dim to pretend that the input
     # is batched, run the computation and before returning squeeze the
     # batch dimension so that the output doesn't carry this temporary batch dimension.
     if not is_batched:
-        # unsqueeze if the input is unbatched
+        # unsqueeze if the input is unbatched (the temporary batch dimension
+        # follows the sequence-first convention)
+        batch_first = False
         query = query.unsqueeze(1)
         key = key.unsqueeze(1)
         value = value.unsqueeze(1)
@@ -415,45 +806,71 @@ def _multi_head_attention_forward(
             key_padding_mask = key_padding_mask.unsqueeze(0)
 
     # set up shape vars
-    tgt_len, bsz, embed_dim = query.shape
-    src_len, _, _ = key.shape
-    assert (
-        embed_dim == embed_dim_to_check
-    ), f"was expecting embedding dimension of {embed_dim_to_check}, but got {embed_dim}"
-    if isinstance(embed_dim, torch.Tensor):
-        # embed_dim can be a tensor when JIT tracing
-        head_dim = embed_dim.div(num_heads, rounding_mode="trunc")
+    if batch_first:
+        bsz, tgt_len, embed_dim = query.shape
+        _, src_len, _ = key.shape
     else:
-        head_dim = embed_dim // num_heads
-    assert (
-        head_dim * num_heads == embed_dim
-    ), f"embed_dim {embed_dim} not divisible by num_heads {num_heads}"
-    if use_separate_proj_weight:
-        # allow MHA to have different embedding dimensions when separate projection weights are used
+        tgt_len, bsz, embed_dim = query.shape
+        src_len, _, _ = key.shape
+    if head_dim is None:
+        if isinstance(embed_dim, torch.Tensor):
+            # embed_dim can be a tensor when JIT tracing
+            head_dim = embed_dim.div(num_heads, rounding_mode="trunc")
+        else:
+            head_dim = embed_dim // num_heads
+    if validate_inputs:
         assert (
-            key.shape[:2] == value.shape[:2]
-        ), f"key's sequence and batch dims {key.shape[:2]} do not match value's {value.shape[:2]}"
-    else:
+            embed_dim == embed_dim_to_check
+        ), f"was expecting embedding dimension of {embed_dim_to_check}, but got {embed_dim}"
         assert (
-            key.shape == value.shape
-        ), f"key shape {key.shape} does not match value shape {value.shape}"
+            head_dim * num_heads == embed_dim
+        ), f"embed_dim {embed_dim} not divisible by num_heads {num_heads}"
+        if use_separate_proj_weight:
+            # allow MHA to have different embedding dimensions when separate projection weights are used
+            assert (
+                key.shape[:2] == value.shape[:2]
+            ), f"key's sequence and batch dims {key.shape[:2]} do not match value's {value.shape[:2]}"
+        else:
+            assert (
+                key.shape == value.shape
+            ), f"key shape {key.shape} does not match value shape {value.shape}"
 
     #
     # compute in-projection
     #
     if not use_separate_proj_weight:
-        q, k, v = _in_projection_packed(query, key, value, in_proj_weight, in_proj_bias)
+        if query is key and key is value:
+            # self-attention: one flattened GEMM over the packed weight computes all
+            # three projections (three times the arithmetic intensity of separate
+            # matmuls) with the bias fused into the epilogue, and the q/k/v unbind
+            # views replace the rearrange copy done by _in_projection_packed
+            q_flat = query.reshape(tgt_len * bsz, embed_dim)
+            if in_proj_bias is not None:
+                qkv = torch.addmm(in_proj_bias, q_flat, in_proj_weight.t())
+            else:
+                qkv = torch.mm(q_flat, in_proj_weight.t())
+            if batch_first:
+                q, k, v = qkv.view(bsz, tgt_len, 3, embed_dim).unbind(2)
+            else:
+                q, k, v = qkv.view(tgt_len, bsz, 3, embed_dim).unbind(2)
+        else:
+            q, k, v = _in_projection_packed(
+                query, key, value, in_proj_weight, in_proj_bias
+            )
     else:
-        assert (
-            q_proj_weight is not None
-        ), "use_separate_proj_weight is True but q_proj_weight is None"
-        assert (
-            k_proj_weight is not None
-        ), "use_separate_proj_weight is True but k_proj_weight is None"
-        assert (
-            v_proj_weight is not None
-        ), "use_separate_proj_weight is True but v_proj_weight is None"
-        if in_proj_bias is None:
+        if validate_inputs:
+            assert (
+                q_proj_weight is not None
+            ), "use_separate_proj_weight is True but q_proj_weight is None"
+            assert (
+                k_proj_weight is not None
+            ), "use_separate_proj_weight is True but k_proj_weight is None"
+            assert (
+                v_proj_weight is not None
+            ), "use_separate_proj_weight is True but v_proj_weight is None"
+        if in_proj_bias_chunks is not None:
+            b_q, b_k, b_v = in_proj_bias_chunks
+        elif in_proj_bias is None:
             b_q = b_k = b_v = None
         else:
             b_q, b_k, b_v = in_proj_bias.chunk(3)
@@ -508,53 +925,67 @@ def _multi_head_attention_forward(
 
     # add bias along batch dimension (currently second)
     if bias_k is not None and bias_v is not None:
-        assert static_k is None, "bias cannot be added to static key."
-        assert static_v is None, "bias cannot be added to static value."
-        k = torch.cat([k, bias_k.repeat(1, bsz, 1)])
-        v = torch.cat([v, bias_v.repeat(1, bsz, 1)])
+        if validate_inputs:
+            assert static_k is None, "bias cannot be added to static key."
+            assert static_v is None, "bias cannot be added to static value."
+        k = _append_bias_row(k, bias_k, batch_first)
+        v = _append_bias_row(v, bias_v, batch_first)
         if attn_mask is not None:
             attn_mask = torch.nn.functional.pad(attn_mask, (0, 1))
         if key_padding_mask is not None:
             key_padding_mask = torch.nn.functional.pad(key_padding_mask, (0, 1))
-    else:
+    elif validate_inputs:
         assert bias_k is None
         assert bias_v is None
 
     #
     # reshape q, k, v for multihead attention and make em batch first
+    # (stride tricks only: the copying flatten to (bsz * num_heads, seq_len, head_dim)
+    # is deferred until a computation actually needs that layout)
     #
-    q = q.contiguous().view(tgt_len, bsz * num_heads, head_dim).transpose(0, 1)
+    if batch_first:
+        q = q.view(bsz, tgt_len, num_heads, head_dim).transpose(1, 2)
+    else:
+        q = q.view(tgt_len, bsz, num_heads, head_dim).permute(1, 2, 0, 3)
     if static_k is None:
-        k = k.contiguous().view(k.shape[0], bsz * num_heads, head_dim).transpose(0, 1)
+        if batch_first:
+            k = k.view(bsz, k.shape[1], num_heads, head_dim).transpose(1, 2)
+        else:
+            k = k.view(k.shape[0], bsz, num_heads, head_dim).permute(1, 2, 0, 3)
     else:
         # TODO finish disentangling control flow so we don't do in-projections when statics are passed
-        assert (
-            static_k.size(0) == bsz * num_heads
-        ), f"expecting static_k.size(0) of {bsz * num_heads}, but got {static_k.size(0)}"
-        assert (
-            static_k.size(2) == head_dim
-        ), f"expecting static_k.size(2) of {head_dim}, but got {static_k.size(2)}"
-        k = static_k
+        if validate_inputs:
+            assert (
+                static_k.size(0) == bsz * num_heads
+            ), f"expecting static_k.size(0) of {bsz * num_heads}, but got {static_k.size(0)}"
+            assert (
+                static_k.size(2) == head_dim
+            ), f"expecting static_k.size(2) of {head_dim}, but got {static_k.size(2)}"
+        k = static_k.unflatten(0, (bsz, num_heads))
     if static_v is None:
-        v = v.contiguous().view(v.shape[0], bsz * num_heads, head_dim).transpose(0, 1)
+        if batch_first:
+            v = v.view(bsz, v.shape[1], num_heads, head_dim).transpose(1, 2)
+        else:
+            v = v.view(v.shape[0], bsz, num_heads, head_dim).permute(1, 2, 0, 3)
     else:
         # TODO finish disentangling control flow so we don't do in-projections when statics are passed
-        assert (
-            static_v.size(0) == bsz * num_heads
-        ), f"expecting static_v.size(0) of {bsz * num_heads}, but got {static_v.size(0)}"
-        assert (
-            static_v.size(2) == head_dim
-        ), f"expecting static_v.size(2) of {head_dim}, but got {static_v.size(2)}"
-        v = static_v
+        if validate_inputs:
+            assert (
+                static_v.size(0) == bsz * num_heads
+            ), f"expecting static_v.size(0) of {bsz * num_heads}, but got {static_v.size(0)}"
+            assert (
+                static_v.size(2) == head_dim
+            ), f"expecting static_v.size(2) of {head_dim}, but got {static_v.size(2)}"
+        v = static_v.unflatten(0, (bsz, num_heads))
 
-    # add zero attention along batch dimension (now first)
+    # add zero attention along source sequence dimension
     if add_zero_attn:
-        zero_attn_shape = (bsz * num_heads, 1, head_dim)
+        zero_attn_shape = (bsz, num_heads, 1, head_dim)
         k = torch.cat(
-            [k, torch.zeros(zero_attn_shape, dtype=k.dtype, device=k.device)], dim=1
+            [k, torch.zeros(zero_attn_shape, dtype=k.dtype, device=k.device)], dim=2
         )
         v = torch.cat(
-            [v, torch.zeros(zero_attn_shape, dtype=v.dtype, device=v.device)], dim=1
+            [v, torch.zeros(zero_attn_shape, dtype=v.dtype, device=v.device)], dim=2
         )
         if attn_mask is not None:
             attn_mask = torch.nn.functional.pad(attn_mask, (0, 1))
@@ -562,39 +993,144 @@ def _multi_head_attention_forward(
             key_padding_mask = torch.nn.functional.pad(key_padding_mask, (0, 1))
 
     # update source sequence length after adjustments
-    src_len = k.size(1)
+    src_len = k.size(2)
 
-    # merge key padding and attention masks
+    # lift the attention mask to the 4-D layout that broadcasts against the
+    # (bsz, num_heads, tgt_len, src_len) scores (views, no allocation)
+    if attn_mask is not None:
+        if attn_mask.size(0) == bsz * num_heads:
+            attn_mask = attn_mask.unflatten(0, (bsz, num_heads))
+        else:
+            attn_mask = attn_mask.unsqueeze(0)
+
+    # merge key padding and attention masks; the key padding mask stays a
+    # zero-copy (bsz, 1, 1, src_len) view that broadcasts over the heads and the
+    # query rows instead of being materialized per head
     if key_padding_mask is not None:
-        assert key_padding_mask.shape == (
-            bsz,
-            src_len,
-        ), f"expecting key_padding_mask shape of {(bsz, src_len)}, but got {key_padding_mask.shape}"
-        key_padding_mask = (
-            key_padding_mask.view(bsz, 1, 1, src_len)
-            .expand(-1, num_heads, -1, -1)
-            .reshape(bsz * num_heads, 1, src_len)
-        )
+        if validate_inputs:
+            assert key_padding_mask.shape == (
+                bsz,
+                src_len,
+            ), f"expecting key_padding_mask shape of {(bsz, src_len)}, but got {key_padding_mask.shape}"
+        key_padding_mask = key_padding_mask.view(bsz, 1, 1, src_len)
         if attn_mask is None:
             attn_mask = key_padding_mask
         elif attn_mask.dtype == torch.bool:
             attn_mask = attn_mask.logical_or(key_padding_mask)
         else:
-            attn_mask = attn_mask.masked_fill(key_padding_mask, attn_mask_value)
+            attn_mask = attn_mask.expand(bsz, *attn_mask.shape[1:]).masked_fill(
+                key_padding_mask, attn_mask_value
+            )
 
     # convert mask to float
     if attn_mask is not None and attn_mask.dtype == torch.bool:
-        new_attn_mask = torch.zeros_like(attn_mask, dtype=q.dtype)
-        new_attn_mask.masked_fill_(attn_mask, attn_mask_value)
+        if mask_cache is not None:
+            # reusing the converted mask when the same bool mask is passed on every
+            # step (e.g. a fixed causal mask), avoiding one full-mask-sized
+            # allocation and writeback per forward; the key is anchored to the
+            # identity of the tensor owning the mask (the mask itself or the base
+            # of the view), the version counter invalidates the entry when the
+            # mask is mutated in place, and the entry is dropped once the owning
+            # tensor is collected so a new mask landing on a reused allocation can
+            # never hit a stale conversion
+            base_mask = attn_mask if attn_mask._base is None else attn_mask._base
+            cache_key = (
+                id(base_mask),
+                attn_mask.data_ptr(),
+                attn_mask.shape,
+                attn_mask.stride(),
+                base_mask._version,
+                q.dtype,
+                attn_mask_value,
+            )
+            new_attn_mask = mask_cache.get(cache_key)
+            if new_attn_mask is None:
+                new_attn_mask = torch.zeros_like(attn_mask, dtype=q.dtype)
+                new_attn_mask.masked_fill_(attn_mask, attn_mask_value)
+                if len(mask_cache) >= MASK_CACHE_MAX_SIZE:
+                    mask_cache.clear()
+                mask_cache[cache_key] = new_attn_mask
+                weakref.finalize(base_mask, mask_cache.pop, cache_key, None)
+        else:
+            new_attn_mask = torch.zeros_like(attn_mask, dtype=q.dtype)
+            new_attn_mask.masked_fill_(attn_mask, attn_mask_value)
         attn_mask = new_attn_mask
 
     # adjust dropout probability
     if not training:
         dropout_p = 0.0
 
+    # fast path: when no attention customization is plugged in, the attention mechanism
+    # is identical to the standard scaled dot product attention and can be computed with
+    # the fused kernel, which avoids materializing the (bsz * num_heads, tgt_len, src_len)
+    # attention weights in memory
+    if (
+        HAS_FUSED_ATTENTION
+        and not need_weights
+        and attention_function is _scaled_dot_product_attention
+        and isinstance(kernel_function, nn.Softmax)
+        and kernel_function.dim == -1
+        and attn_masking_function is _attn_masking
+        and query_key_product is _scaled_dot_product
+    ):
+        attn_output = torch.nn.functional.scaled_dot_product_attention(
+            q, k, v, attn_mask=attn_mask, dropout_p=dropout_p, is_causal=False
+        )
+        if batch_first:
+            attn_output = attn_output.transpose(1, 2).reshape(bsz, tgt_len, embed_dim)
+        else:
+            attn_output = attn_output.permute(2, 0, 1, 3).reshape(
+                tgt_len, bsz, embed_dim
+            )
+        attn_output = linear(attn_output, out_proj_weight, out_proj_bias)
+        if not is_batched:
+            # squeeze the output if input was unbatched
+            attn_output = attn_output.squeeze(1)
+        return attn_output, None
+
+    # tiled path: when the custom kernel function is pointwise the attention output can
+    # be accumulated tile by tile over the score matrix, which also avoids materializing
+    # the (bsz * num_heads, tgt_len, src_len) attention weights in memory
+    if (
+        not need_weights
+        and attention_function is _scaled_dot_product_attention
+        and is_pointwise_kernel_function(kernel_function)
+        and attn_masking_function is _attn_masking
+        and query_key_product is _scaled_dot_product
+    ):
+        attn_output = tiled_scaled_dot_product_attention(
+            q, k, v, attn_mask, dropout_p, kernel_function=kernel_function
+        )
+        if batch_first:
+            attn_output = attn_output.transpose(1, 2).reshape(bsz, tgt_len, embed_dim)
+        else:
+            attn_output = attn_output.permute(2, 0, 1, 3).reshape(
+                tgt_len, bsz, embed_dim
+            )
+        attn_output = linear(attn_output, out_proj_weight, out_proj_bias)
+        if not is_batched:
+            # squeeze the output if input was unbatched
+            attn_output = attn_output.squeeze(1)
+        return attn_output, None
+
     #
     # (deep breath) calculate attention and out projection
     #
+    # the customizable attention functions consume the flattened 3-D layout, which
+    # needs the mask expanded over the heads (the one remaining mask copy)
+    if attn_mask is not None:
+        if attn_mask.size(0) == 1 and attn_mask.size(1) == 1:
+            attn_mask = attn_mask.squeeze(0)
+        else:
+            attn_mask = attn_mask.expand(bsz, num_heads, -1, -1).reshape(
+                bsz * num_heads, attn_mask.size(2), attn_mask.size(3)
+            )
+
+    # the customizable attention functions work on the (bsz * num_heads, seq_len, head_dim)
+    # layout: flattening here is the single copy of q, k and v in the whole forward
+    q = q.reshape(bsz * num_heads, tgt_len, head_dim)
+    k = k.reshape(bsz * num_heads, src_len, head_dim)
+    v = v.reshape(bsz * num_heads, src_len, head_dim)
     attn_output, attn_output_weights = attention_function(
         q,
         k,
@@ -605,11 +1141,24 @@ def _multi_head_attention_forward(
         attn_mask_value=attn_mask_value,
         attn_masking_function=attn_masking_function,
         query_key_product=query_key_product,
+        max_chunk_size_mb=max_chunk_size_mb,
+        q_scale=q_scale,
+        need_weights=need_weights,
+        scratch=scratch,
     )
-    attn_output = attn_output.transpose(0, 1).contiguous().view(tgt_len, bsz, embed_dim)
+    if batch_first:
+        attn_output = (
+            attn_output.unflatten(0, (bsz, num_heads))
+            .transpose(1, 2)
+            .reshape(bsz, tgt_len, embed_dim)
+        )
+    else:
+        attn_output = (
+            attn_output.transpose(0, 1).contiguous().view(tgt_len, bsz, embed_dim)
+        )
     attn_output = linear(attn_output, out_proj_weight, out_proj_bias)
 
-    if need_weights:
+    if need_weights and attn_output_weights is not None:
         # optionally average attention weights over heads
         attn_output_weights = attn_output_weights.view(bsz, num_heads, tgt_len, src_len)
         if average_attn_weights:
@@ -0,0 +1,101 @@
+"""Tiled scaled dot product attention for pointwise custom kernel functions."""
+
+import math
+from typing import Callable, Optional, Set, Type, Union
+
+import torch
+from torch import Tensor, nn
+from torch.nn.functional import dropout
+
+# number of query rows processed per tile
+BLOCK_M = 64
+# number of key/value rows processed per tile
+BLOCK_N = 64
+
+# kernel functions that are applied elementwise to the attention scores.
+# since they do not normalize across the source dimension, the attention output
+# can be accumulated tile by tile without materializing the full score matrix.
+POINTWISE_KERNEL_FUNCTIONS: Set[Type[nn.Module]] = {nn.ReLU, nn.ELU}
+
+
+def register_pointwise_kernel_function(kernel_function_class: Type[nn.Module]) -> None:
+    """Registers a kernel function class as pointwise.
+
+    Registered classes are eligible for the tiled attention computation.
+
+    Args:
+        kernel_function_class: class of a kernel function applied elementwise to the attention scores.
+    """
+    POINTWISE_KERNEL_FUNCTIONS.add(kernel_function_class)
+
+
+def is_pointwise_kernel_function(
+    kernel_function: Union[nn.Module, Callable]
+) -> bool:
+    """Establishes if a kernel function is applied elementwise to the attention scores.
+
+    Args:
+        kernel_function: function applied to the masked attention.
+
+    Returns:
+        whether the kernel function is registered as pointwise.
+    """
+    return isinstance(kernel_function, tuple(POINTWISE_KERNEL_FUNCTIONS))
+
+
+def tiled_scaled_dot_product_attention(
+    q: Tensor,
+    k: Tensor,
+    v: Tensor,
+    attn_mask: Optional[Tensor] = None,
+    dropout_p: float = 0.0,
+    kernel_function: Union[nn.Module, Callable] = nn.ReLU(),
+) -> Tensor:
+    """Scaled dot product attention computed in tiles over the score matrix.
+
+    The scores are computed, masked, passed through the kernel function and
+    multiplied against the values one (BLOCK_M, BLOCK_N) tile at a time, so the
+    full (..., Nt, Ns) score matrix is never materialized. The kernel function
+    must be pointwise for the tiled accumulation to be equivalent to the dense
+    computation.
+
+    Args:
+        q: attention query values of shape (..., Nt, E).
+        k: attention key values of shape (..., Ns, E).
+        v: attention value values of shape (..., Ns, E).
+        attn_mask: additive attention mask broadcastable to (..., Nt, Ns). Defaults to None.
+        dropout_p: dropout probability applied to the kernel output. Defaults to 0.0.
+        kernel_function: pointwise function applied to the masked attention. Defaults to ReLU().
+
+    Returns:
+        attention output of shape (..., Nt, E).
+    """
+    Nt, E = q.shape[-2], q.shape[-1]
+    Ns = k.shape[-2]
+    q = q / math.sqrt(E)
+
+    if attn_mask is not None:
+        # broadcasting the mask to the score matrix sizes (views, no allocation)
+        # so that it can be sliced consistently with the score tiles
+        attn_mask = attn_mask.expand(*attn_mask.shape[:-2], Nt, Ns)
+
+    output = torch.empty((*q.shape[:-1], v.shape[-1]), dtype=q.dtype, device=q.device)
+    for i in range(0, Nt, BLOCK_M):
+        q_tile = q[..., i : i + BLOCK_M, :]
+        acc = torch.zeros(
+            (*q_tile.shape[:-1], v.shape[-1]), dtype=q.dtype, device=q.device
+        )
+        for j in range(0, Ns, BLOCK_N):
+            # (..., BLOCK_M, E) x (..., E, BLOCK_N) -> (..., BLOCK_M, BLOCK_N)
+            scores = torch.matmul(
+                q_tile, k[..., j : j + BLOCK_N, :].transpose(-2, -1)
+            )
+            if attn_mask is not None:
+                scores += attn_mask[..., i : i + BLOCK_M, j : j + BLOCK_N]
+            scores = kernel_function(scores)
+            if dropout_p > 0.0:
+                scores = dropout(scores, p=dropout_p)
+            # (..., BLOCK_M, BLOCK_N) x (..., BLOCK_N, E) -> (..., BLOCK_M, E)
+            acc += torch.matmul(scores, v[..., j : j + BLOCK_N, :])
+        output[..., i : i + BLOCK_M, :] = acc
+    return output
@@ -20,6 +20,9 @@ from .approximators.attention.masking.multiplicative import (  # noqa
 from .approximators.attention.query_key_product.not_scaled import (  # noqa
     NotScaledQueryKeyDotProductApproximator,
 )
+from .approximators.attention.query_key_product.quantized import (  # noqa
+    Int8QueryKeyDotProductApproximator,
+)
 from .approximators.core import ModuleApproximator
 from .approximators.layer_normalization.batch_normalization import (  # noqa
     LayerNormToBatchNormApproximator,
@@ -4,6 +4,7 @@ from argparse import ArgumentParser
 
 import importlib_resources
 import pytorch_lightning as pl
+import torch
 
 from ..models.tokenizers.smiles import SmilesTokenizer
 from ..pytorch_lightning.datasets.smiles import LitSmilesDataset
@@ -19,8 +20,6 @@ SMILES_VOCAB_FILE = str(
 
 
 def main():
-    pl.seed_everything(42)
-
     # adding to the parser the arguments needed from each component
     parser = ArgumentParser()
     parser = pl.Trainer.add_argparse_args(parser)  # type: ignore
@@ -28,8 +27,30 @@ def main():
     parser = LitSmilesDataset.add_dataset_specific_args(parser)
     parser.add_argument("--vocabulary", type=str, default=SMILES_VOCAB_FILE)
     parser.add_argument("--ckpt", type=str, default=None, required=False)
+    parser.add_argument("--compile", action="store_true")
+    parser.add_argument(
+        "--compile_mode",
+        type=str,
+        default="default",
+        choices=["default", "reduce-overhead", "max-autotune"],
+    )
+    parser.add_argument("--seed", type=int, default=42)
     args = parser.parse_args()
 
+    # reusing the --deterministic flag that pl.Trainer.add_argparse_args already
+    # registers, so the same option drives the trainer, the seeding and the
+    # kernel selection
+    deterministic = bool(vars(args).get("deterministic") or False)
+
+    pl.seed_everything(vars(args)["seed"], workers=deterministic)
+
+    # without the reproducibility constraint the fast non-deterministic kernels
+    # (cuDNN autotuning, TF32 matmuls) can be enabled
+    if not deterministic:
+        torch.backends.cudnn.benchmark = True
+        if hasattr(torch, "set_float32_matmul_precision"):
+            torch.set_float32_matmul_precision("high")
+
     # building the lightning dataset
     tokenizer = SmilesTokenizer(vars(args)["vocabulary"])
     smiles_dataset = LitSmilesDataset(dataset_args=vars(args), tokenizer=tokenizer)
@@ -42,6 +63,15 @@ def main():
     # defining the lightning model
     model = LitVanillaTransformer(model_args=vars(args), tokenizer=tokenizer)
 
+    # optionally compiling the model: fuses the pointwise operations around the
+    # attention and removes per-step Python dispatch overhead
+    if vars(args)["compile"]:
+        if not hasattr(torch, "compile"):
+            raise RuntimeError("--compile requires torch>=2.0")
+        model = torch.compile(
+            model, mode=vars(args)["compile_mode"], fullgraph=False, dynamic=True
+        )
+
     # training and validating the model loading the model from the specified checkpoint
     trainer = pl.Trainer.from_argparse_args(args)
     trainer.fit(
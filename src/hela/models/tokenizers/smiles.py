@@ -6,14 +6,24 @@ import collections
 import logging
 import os
 import re
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
+import numpy as np
+import torch
 from rxn.chemutils.tokenization import SMILES_TOKENIZER_PATTERN
 from transformers.models.bert import BertTokenizer
+from transformers.tokenization_utils_base import BatchEncoding
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+# characters that SMILES_TOKENIZER_PATTERN can only ever match as
+# single-character tokens: a string made exclusively of these characters
+# tokenizes to exactly one token per character, so a lookup table over the
+# string bytes reproduces the regex output. Characters that can start or
+# continue a multi-character token ("[", "]", "%", "r", "l", ">") are left out.
+SINGLE_CHAR_SMILES_TOKENS = "BCNOSPFIbcnosp|().=#-+\\/:~@?*$0123456789"
+
 
 class SmilesTokenizer(BertTokenizer):
     """Tokenizer for smiles.
@@ -62,6 +72,16 @@ class SmilesTokenizer(BertTokenizer):
         self.basic_tokenizer = BasicSmilesTokenizer()
         self.init_kwargs["model_max_length"] = self.model_max_length
 
+        # lookup tables for the vectorized tokenization: byte -> vocabulary index
+        # for the single-character tokens, and byte -> whether the lookup result
+        # is guaranteed to match the regex tokenization
+        unk_index = self.vocab[self.unk_token]
+        self._single_char_lut = np.full(256, unk_index, dtype=np.int64)
+        self._lut_safe = np.zeros(256, dtype=bool)
+        for char in SINGLE_CHAR_SMILES_TOKENS:
+            self._lut_safe[ord(char)] = True
+            self._single_char_lut[ord(char)] = self.vocab.get(char, unk_index)
+
     @property
     def vocab_size(self) -> int:
         """Gets the vocabulary size.
@@ -92,6 +112,87 @@ class SmilesTokenizer(BertTokenizer):
         split_tokens = [token for token in self.basic_tokenizer.tokenize(text)]
         return split_tokens
 
+    def token_ids(self, text: str) -> np.ndarray:
+        """Converts a SMILES string to vocabulary indices, without special tokens.
+
+        Strings composed only of single-character tokens (the vast majority) are
+        converted with one vectorized lookup over the string bytes instead of a
+        Python loop; the remaining ones fall back to the regex tokenization.
+
+        Args:
+            text: SMILES string.
+
+        Returns:
+            array of vocabulary indices.
+        """
+        text_bytes = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+        if self._lut_safe[text_bytes].all():
+            return self._single_char_lut[text_bytes]
+        unk_index = self.vocab[self.unk_token]
+        return np.array(
+            [
+                self.vocab.get(token, unk_index)
+                for token in self.basic_tokenizer.tokenize(text)
+            ],
+            dtype=np.int64,
+        )
+
+    def encode_batch(
+        self,
+        texts: List[str],
+        max_length: int,
+        truncation: bool = True,
+        padding: Union[bool, str] = "max_length",
+    ) -> BatchEncoding:
+        """Encodes a batch of SMILES strings into padded batch tensors.
+
+        Vectorized replacement for calling the tokenizer once per string: the
+        token indices are produced by `token_ids` and written, together with the
+        special and padding tokens, directly into preallocated batch arrays.
+
+        Args:
+            texts: SMILES strings.
+            max_length: length to which every sequence is padded (or truncated).
+            truncation: whether sequences longer than max_length are truncated. Defaults to True.
+            padding: padding strategy, either "max_length" or "longest"/True
+                (pad to the longest sequence of the batch). Defaults to "max_length".
+
+        Raises:
+            ValueError: when the padding strategy cannot produce rectangular batch tensors.
+
+        Returns:
+            batch encoding containing the (len(texts), padded_length) input_ids and attention_mask tensors.
+        """
+        ids_per_text = [self.token_ids(text) for text in texts]
+        if truncation:
+            ids_per_text = [ids[: max_length - 2] for ids in ids_per_text]
+        # +2 accounts for the cls and sep tokens wrapping every sequence
+        lengths = [ids.shape[0] + 2 for ids in ids_per_text]
+        if padding == "max_length":
+            padded_length = max_length
+        elif padding == "longest" or padding is True:
+            padded_length = max(lengths, default=0)
+        else:
+            raise ValueError(
+                f"padding strategy {padding!r} is not supported by the batch encoding: "
+                'the batch tensors must be rectangular, use "max_length" or "longest"'
+            )
+        input_ids = np.full(
+            (len(texts), padded_length), self.pad_token_id, dtype=np.int64
+        )
+        attention_mask = np.zeros((len(texts), padded_length), dtype=np.int64)
+        for row, (ids, length) in enumerate(zip(ids_per_text, lengths)):
+            input_ids[row, 0] = self.cls_token_id
+            input_ids[row, 1 : length - 1] = ids
+            input_ids[row, length - 1] = self.sep_token_id
+            attention_mask[row, :length] = 1
+        return BatchEncoding(
+            {
+                "input_ids": torch.from_numpy(input_ids),
+                "attention_mask": torch.from_numpy(attention_mask),
+            }
+        )
+
     def _convert_token_to_id(self, token: str) -> int:
         """Converts a token to the corresponding index in the vocabulary.
 
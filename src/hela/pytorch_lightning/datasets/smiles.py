@@ -6,7 +6,7 @@ import os
 from argparse import ArgumentParser
 from functools import lru_cache
 from pathlib import PosixPath
-from typing import Any, Dict, List, Union
+from typing import Any, Callable, Dict, List, Optional, Union
 
 import pytorch_lightning as pl
 from torch.utils.data import ConcatDataset, DataLoader, Dataset
@@ -25,14 +25,16 @@ class SmilesDataset(Dataset):
     def __init__(
         self,
         filepath: str,
-        tokenizer: SmilesTokenizer,
+        tokenizer: Optional[Callable] = None,
         padding_idx: int = 0,
     ) -> None:
         """Initialize the LM data module.
 
         Args:
             filepath: path where the dataset is located.
-            tokenizer: tokenize function to be used in the module.
+            tokenizer: tokenize function to be used in the module; when None the
+                raw examples are returned and tokenization is left to the
+                collate function. Defaults to None.
         """
 
         self.filepath = filepath
@@ -96,6 +98,11 @@ class SmilesDataset(Dataset):
         examples = self.examples_reader()
         example = examples[index]
 
+        # without a tokenizer the raw example is returned and the whole batch is
+        # tokenized at once in the collate function
+        if self.tokenizer is None:
+            return example
+
         item = {}
         source_item = self.tokenizer(example["source"])
         target_item = self.tokenizer(example["target"])
@@ -134,7 +141,15 @@ class LitSmilesDataset(pl.LightningDataModule):
 
         self.tokenizer = tokenizer
 
-        self.data_collator = default_data_collator
+        # with batch tokenization the samples stay raw strings and the collate
+        # function tokenizes the whole batch in one vectorized pass
+        self.batch_tokenization = bool(
+            self.dataset_args.get("batch_tokenization", True)
+        ) and hasattr(self.tokenizer, "encode_batch")
+        if self.batch_tokenization:
+            self.data_collator = self.batch_collate
+        else:
+            self.data_collator = default_data_collator
 
         cpus_count = os.cpu_count()
         if cpus_count is not None:
@@ -153,16 +168,17 @@ class LitSmilesDataset(pl.LightningDataModule):
             pytorch dataset.
         """
         path = str(path)
+        tokenize = None if self.batch_tokenization else self.tokenize_function
         if path.endswith(".jsonl") or path.endswith(".json"):
             return SmilesDataset(
-                path, self.tokenize_function, padding_idx=self.tokenizer.pad_token_id
+                path, tokenize, padding_idx=self.tokenizer.pad_token_id
             )
         elif os.path.isdir(path):
             return ConcatDataset(
                 datasets=[
                     SmilesDataset(
                         os.path.join(path, filename),
-                        self.tokenize_function,
+                        tokenize,
                         padding_idx=self.tokenizer.pad_token_id,
                     )
                     for filename in os.listdir(path)
@@ -196,6 +212,41 @@ class LitSmilesDataset(pl.LightningDataModule):
             return_tensors="pt",
         )
 
+    def batch_collate(self, examples: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Tokenizes and collates a batch of raw examples in a single pass.
+
+        Args:
+            examples: raw examples, each holding a source and a target string.
+
+        Raises:
+            ValueError: when the configured padding strategy is not supported by the batch encoding.
+
+        Returns:
+            batch dictionary with the encoder/decoder input ids and padding masks.
+        """
+        max_length = self.dataset_args.get("max_length", 278)
+        truncation = self.dataset_args.get("truncation", True)
+        padding = self.dataset_args.get("padding", "max_length")
+        source = self.tokenizer.encode_batch(
+            [example["source"] for example in examples],
+            max_length=max_length,
+            truncation=truncation,
+            padding=padding,
+        )
+        target = self.tokenizer.encode_batch(
+            [example["target"] for example in examples],
+            max_length=max_length,
+            truncation=truncation,
+            padding=padding,
+        )
+        padding_idx = self.tokenizer.pad_token_id
+        return {
+            "encoder_input_ids": source["input_ids"],
+            "encoder_padding_mask": source["attention_mask"].eq(padding_idx),
+            "decoder_input_ids": target["input_ids"],
+            "decoder_padding_mask": target["attention_mask"].eq(padding_idx),
+        }
+
     def load(self) -> None:
         """Loads train, validation and test datasets from the given files."""
 
@@ -209,6 +260,30 @@ class LitSmilesDataset(pl.LightningDataModule):
             f"Training set size: {len(self.datasets['train'])} - Validation set size: {len(self.datasets['validation'])} - Test set size: {len(self.datasets['test'])}"  # type: ignore
         )
 
+    def dataloader_kwargs(self) -> Dict[str, Any]:
+        """Collects the throughput-related dataloader arguments.
+
+        Pinned memory allows asynchronous host-to-device copies, while
+        persistent workers and prefetching keep the tokenization overlapped
+        with the training computation instead of serializing with it.
+
+        Returns:
+            keyword arguments shared by all the dataloaders.
+        """
+        num_workers = self.dataset_args["num_dataloader_workers"]
+        kwargs: Dict[str, Any] = {
+            "num_workers": num_workers,
+            "collate_fn": self.data_collator,
+            "pin_memory": self.dataset_args.get("pin_memory", True),
+        }
+        # persistent workers and prefetching are only supported with worker processes
+        if num_workers > 0:
+            kwargs["persistent_workers"] = self.dataset_args.get(
+                "persistent_workers", True
+            )
+            kwargs["prefetch_factor"] = self.dataset_args.get("prefetch_factor", 4)
+        return kwargs
+
     def train_dataloader(self) -> DataLoader:
         """Creates the dataloader for the traning step.
 
@@ -218,8 +293,7 @@ class LitSmilesDataset(pl.LightningDataModule):
         return DataLoader(
             self.datasets["train"],  # type: ignore
             batch_size=self.dataset_args["batch_size"],
-            num_workers=self.dataset_args["num_dataloader_workers"],
-            collate_fn=self.data_collator,
+            **self.dataloader_kwargs(),
         )
 
     def val_dataloader(self) -> DataLoader:
@@ -231,8 +305,7 @@ class LitSmilesDataset(pl.LightningDataModule):
         return DataLoader(
             self.datasets["validation"],  # type: ignore
             batch_size=1,
-            num_workers=self.dataset_args["num_dataloader_workers"],
-            collate_fn=self.data_collator,
+            **self.dataloader_kwargs(),
         )
 
     def test_dataloader(self) -> DataLoader:
@@ -244,8 +317,7 @@ class LitSmilesDataset(pl.LightningDataModule):
         return DataLoader(
             self.datasets["test"],  # type: ignore
             batch_size=1,
-            num_workers=self.dataset_args["num_dataloader_workers"],
-            collate_fn=self.data_collator,
+            **self.dataloader_kwargs(),
         )
 
     @staticmethod
@@ -263,9 +335,13 @@ class LitSmilesDataset(pl.LightningDataModule):
         parser.add_argument("--validation_file", type=str, required=True)
         parser.add_argument("--test_file", type=str, required=True)
         parser.add_argument("--num_dataloader_workers", type=int, default=8)
+        parser.add_argument("--pin_memory", type=bool, default=True)
+        parser.add_argument("--persistent_workers", type=bool, default=True)
+        parser.add_argument("--prefetch_factor", type=int, default=4)
         parser.add_argument("--max_length", type=int, default=278)
         parser.add_argument("--padding", type=str, default="max_length")
         parser.add_argument("--truncation", type=bool, default=True)
         parser.add_argument("--batch_size", type=int, default=32)
+        parser.add_argument("--batch_tokenization", type=bool, default=True)
 
         return parser
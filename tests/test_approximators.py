@@ -24,6 +24,10 @@ from hela.approximation.approximators.attention.query_key_product.not_scaled imp
     NotScaledQueryKeyDotProduct,
     NotScaledQueryKeyDotProductApproximator,
 )
+from hela.approximation.approximators.attention.query_key_product.quantized import (
+    Int8QueryKeyDotProduct,
+    Int8QueryKeyDotProductApproximator,
+)
 from hela.approximation.approximators.core import ModuleApproximator
 from hela.approximation.approximators.layer_normalization.batch_normalization import (
     BatchNorm1dForTransformers,
@@ -37,6 +41,7 @@ from hela.approximation.approximators.layer_normalization.distill_layernorm impo
 from hela.approximation.approximators.multihead.customizable_multihead import (
     CustomizableMultiHead,
     CustomizableMultiHeadApproximator,
+    _scaled_dot_product,
 )
 from hela.approximation.approximators.softmax.mlp_softmax import (
     MLPSoftmaxApproximation,
@@ -310,6 +315,26 @@ testing_informations = {
             torch.ones((sequence_length, sequence_length), device=DEVICE),
         ],
     },
+    "Int8QueryKeyProductApproximator": {
+        "approximator_class": Int8QueryKeyDotProductApproximator,
+        "init_parameters": [{}],
+        "trainable_approximation_class": Int8QueryKeyDotProduct,
+        "get_trainable_approximation_kwargs": [{}],
+        "pretrained_approximation_class": Int8QueryKeyDotProduct,
+        "forward_kwargs": {
+            "query": torch.ones(
+                (batch_size, sequence_length, embedding_dim), device=DEVICE
+            ),
+            "key": torch.ones(
+                (batch_size, sequence_length, embedding_dim), device=DEVICE
+            )
+            * 2,
+        },
+        "output_type": Tensor,
+        "expected_output": [
+            None,
+        ],
+    },
     "NotScaledQueryKeyProductApproximator": {
         "approximator_class": NotScaledQueryKeyDotProductApproximator,
         "init_parameters": [{}],
@@ -489,6 +514,155 @@ def test_get_pretrained_approximation(
         )
 
 
+def test_customizable_multihead_fused_attention_fast_path():
+    """Tests that the fused attention fast path matches the customizable attention path."""
+    embed_dim = 16
+    num_heads = 4
+    sequence_length = 8
+
+    torch.manual_seed(42)
+    multihead = CustomizableMultiHead(embed_dim=embed_dim, num_heads=num_heads).to(
+        DEVICE
+    )
+    multihead.eval()
+
+    query = torch.rand((sequence_length, batch_size, embed_dim), device=DEVICE)
+    attn_mask = torch.triu(
+        torch.ones((sequence_length, sequence_length), device=DEVICE) * float("-inf"),
+        diagonal=1,
+    )
+
+    with torch.no_grad():
+        # the fused fast path is taken only when the attention weights are not requested
+        fused_output, fused_weights = multihead(
+            query, query, query, attn_mask=attn_mask, need_weights=False
+        )
+        custom_output, _ = multihead(
+            query, query, query, attn_mask=attn_mask, need_weights=True
+        )
+
+    # ASSERTS
+
+    assert fused_weights is None
+    assert torch.allclose(fused_output, custom_output, atol=1e-6)
+
+
+def test_customizable_multihead_tiled_attention_fast_path():
+    """Tests that the tiled attention fast path matches the customizable attention path."""
+    embed_dim = 16
+    num_heads = 4
+    # longer than the tile sizes (and not a multiple) to exercise several ragged tiles
+    sequence_length = 130
+
+    torch.manual_seed(42)
+    multihead = CustomizableMultiHead(
+        embed_dim=embed_dim, num_heads=num_heads, kernel_function=nn.ReLU()
+    ).to(DEVICE)
+    multihead.eval()
+
+    query = torch.rand((sequence_length, batch_size, embed_dim), device=DEVICE)
+    attn_mask = torch.triu(
+        torch.ones((sequence_length, sequence_length), device=DEVICE) * float("-inf"),
+        diagonal=1,
+    )
+
+    with torch.no_grad():
+        # the tiled fast path is taken only when the attention weights are not requested
+        tiled_output, tiled_weights = multihead(
+            query, query, query, attn_mask=attn_mask, need_weights=False
+        )
+        custom_output, _ = multihead(
+            query, query, query, attn_mask=attn_mask, need_weights=True
+        )
+
+    # ASSERTS
+
+    assert tiled_weights is None
+    assert torch.allclose(tiled_output, custom_output, atol=1e-5)
+
+
+def test_customizable_multihead_chunked_attention():
+    """Tests that the chunked attention computation matches the unchunked one."""
+    embed_dim = 16
+    num_heads = 4
+    sequence_length = 130
+
+    torch.manual_seed(42)
+    multihead = CustomizableMultiHead(embed_dim=embed_dim, num_heads=num_heads).to(
+        DEVICE
+    )
+    multihead.eval()
+    chunked_multihead = CustomizableMultiHead(
+        embed_dim=embed_dim, num_heads=num_heads, max_chunk_size_mb=1
+    ).to(DEVICE)
+    chunked_multihead.eval()
+    chunked_multihead.load_state_dict(multihead.state_dict())
+
+    query = torch.rand((sequence_length, batch_size, embed_dim), device=DEVICE)
+    attn_mask = torch.triu(
+        torch.ones((sequence_length, sequence_length), device=DEVICE) * float("-inf"),
+        diagonal=1,
+    )
+
+    with torch.no_grad():
+        output, weights = multihead(
+            query, query, query, attn_mask=attn_mask, need_weights=True
+        )
+        chunked_output, chunked_weights = chunked_multihead(
+            query, query, query, attn_mask=attn_mask, need_weights=True
+        )
+
+    # ASSERTS
+
+    assert torch.allclose(chunked_output, output, atol=1e-6)
+    assert torch.allclose(chunked_weights, weights, atol=1e-6)
+
+
+def test_customizable_multihead_backward():
+    """Tests that the attention forward supports autograd on the customizable path."""
+    embed_dim = 16
+    num_heads = 4
+    sequence_length = 8
+
+    torch.manual_seed(42)
+    multihead = CustomizableMultiHead(embed_dim=embed_dim, num_heads=num_heads).to(
+        DEVICE
+    )
+
+    query = torch.rand(
+        (sequence_length, batch_size, embed_dim), device=DEVICE, requires_grad=True
+    )
+    # need_weights forces the customizable path without an additive mask, which
+    # must go through the differentiable query-key product
+    output, weights = multihead(query, query, query, need_weights=True)
+    output.sum().backward()
+
+    # ASSERTS
+
+    assert query.grad is not None
+    assert not torch.isnan(query.grad).any()
+
+
+def test_int8_query_key_product_accuracy():
+    """Tests that the int8 quantized query-key product approximates the exact one."""
+    embed_dim = 16
+    sequence_length = 8
+
+    torch.manual_seed(42)
+    query = torch.rand((batch_size, sequence_length, embed_dim), device=DEVICE)
+    key = torch.rand((batch_size, sequence_length, embed_dim), device=DEVICE)
+
+    quantized_product = Int8QueryKeyDotProduct().to(DEVICE)
+    with torch.no_grad():
+        output = quantized_product(query, key)
+        expected_output = _scaled_dot_product(query, key)
+
+    # ASSERTS
+
+    # the quantization error is bounded by the per-row int8 resolution
+    assert torch.allclose(output, expected_output, atol=1e-2)
+
+
 @pytest.mark.parametrize(
     "approximator_identifier",
     list(testing_informations.keys()),